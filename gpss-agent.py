@@ -16,20 +16,386 @@ import ssl
 import hashlib
 import socket
 import re
+import atexit
+import copy
+import queue
+import tempfile
+import concurrent.futures
+import threading
+import logging
+import logging.handlers
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+
+try:
+    import winreg
+except ImportError:  # not running on Windows
+    winreg = None
 
 # Configuration
 SERVER_URL = "https://vm.gpss.ro/api"
 CONFIG_FILE = "config.json"
 HEARTBEAT_INTERVAL = 60  # seconds
 COMMAND_CHECK_INTERVAL = 30  # seconds
+LOG_FILE = "gpss-agent.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024  # rotate after 5 MB
+LOG_BACKUP_COUNT = 3
+LOG_REPEAT_WINDOW = 300  # seconds to suppress identical warnings/errors
+KB_CACHE_TTL = 6 * 3600  # seconds; only used when servicing state is unreadable
+
+# Component Based Servicing (CBS) registry locations
+CBS_KEY = r"SOFTWARE\Microsoft\Windows\CurrentVersion\Component Based Servicing"
+REBOOT_PENDING_KEYS = [
+    CBS_KEY + r"\RebootPending",
+    r"SOFTWARE\Microsoft\Windows\CurrentVersion\WindowsUpdate\Auto Update\RebootRequired",
+]
+# CBS package CurrentState values we report; higher rank wins when a KB has several packages
+CBS_PACKAGE_STATES = {
+    0x05: ('pending_reboot', 4),  # uninstall pending
+    0x60: ('pending_reboot', 4),  # install pending
+    0x70: ('installed', 3),
+    0x80: ('installed', 3),       # permanent
+    0x40: ('staged', 2),
+    0x50: ('superseded', 1),
+}
+KB_PATTERN = re.compile(r'KB\d+', re.IGNORECASE)
+
+# Data collectors that can be switched on/off from the server
+COLLECTORS = ['internal_ip', 'cpu', 'ram', 'disk', 'windows_serial', 'installed_kbs', 'installed_software']
+
+# Settings the server may push; applied live without restarting the agent
+DEFAULT_SETTINGS = {
+    'heartbeat_interval': HEARTBEAT_INTERVAL,
+    'command_check_interval': COMMAND_CHECK_INTERVAL,
+    'log_level': 'INFO',
+    'enabled_collectors': list(COLLECTORS),
+}
+WINDOWS_COLLECTORS = {'windows_serial', 'installed_kbs', 'installed_software'}
+
+# Collectors run concurrently; each has its own deadline inside a global budget.
+# One worker per collector, so no collector waits in the queue and loses time.
+COLLECTOR_WORKERS = len(COLLECTORS)
+COLLECTION_BUDGET = 60  # seconds for a whole round; caps the longer per-collector timeouts
+COLLECTOR_TIMEOUTS = {  # seconds
+    'internal_ip': 5,
+    'cpu': 10,
+    'ram': 10,
+    'disk': 10,
+    'windows_serial': 15,
+    'installed_kbs': 45,
+    'installed_software': 75,
+}
+
+# On-demand command results
+RESULT_CHUNK_SIZE = 256 * 1024  # characters of serialized JSON per chunk
+PROGRESS_INTERVAL = 5  # seconds between progress updates for long operations
+HASH_ALGORITHMS = ['md5', 'sha1', 'sha256', 'sha512']
+
+SETTING_INTERVAL_LIMITS = {
+    'heartbeat_interval': (10, 86400),
+    'command_check_interval': (5, 3600),
+}
+
+logger = logging.getLogger('gpss-agent')
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Human readable console lines, annotated with suppression counts"""
+
+    def __init__(self):
+        super().__init__('[%(asctime)s] %(levelname)s %(message)s', datefmt='%H:%M:%S')
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        if getattr(record, 'suppressed', 0):
+            line += f" ({record.suppressed} identical messages suppressed)"
+        return line
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps exception info for the listener's formatters.
+
+    The stock ``prepare()`` bakes the traceback into ``msg`` and drops
+    ``exc_info``; records stay in-process here, so they can be passed as is.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+class RepeatFilter(logging.Filter):
+    """Suppress identical warnings/errors inside a time window.
+
+    The first occurrence is logged; repeats are counted. When the window
+    expires, the count is reported by ``flush_expired()`` (or attached as
+    ``suppressed`` to the next occurrence if that comes first).
+    """
+
+    def __init__(self, window=LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.window = window
+        self._seen = {}  # (level, message) -> [first_logged_at, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or getattr(record, 'repeat_summary', False):
+            return True
+
+        key = (record.levelno, record.getMessage())
+        now = record.created
+        with self._lock:
+            state = self._seen.get(key)
+            if state and now - state[0] < self.window:
+                state[1] += 1
+                return False
+            record.suppressed = state[1] if state else 0
+            self._seen[key] = [now, 0]
+        return True
+
+    def flush_expired(self, now=None, force=False):
+        """Log suppression counts for windows that have ended and forget them"""
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            for key, (first_logged_at, suppressed) in list(self._seen.items()):
+                if force or now - first_logged_at >= self.window:
+                    del self._seen[key]
+                    if suppressed:
+                        expired.append((key, suppressed))
+
+        # Log outside the lock; summaries bypass this filter
+        for (level, message), suppressed in expired:
+            logger.log(level, f"Repeated: {message}",
+                       extra={'suppressed': suppressed, 'repeat_summary': True})
+
+
+def _flush_repeats_periodically(repeat_filter, stop_event):
+    """Background loop reporting suppressed-message counts once their window ends"""
+    interval = max(1, min(30, repeat_filter.window / 4))
+    while not stop_event.wait(interval):
+        repeat_filter.flush_expired()
+
+
+def setup_logging(log_dir, level='INFO'):
+    """Route agent logs through a queue to the console and a rotating JSON file"""
+    handlers = []
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(ConsoleFormatter())
+    handlers.append(console)
+
+    try:
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, LOG_FILE),
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    except OSError as e:
+        print(f"Cannot open log file in {log_dir}: {e}")
+
+    log_queue = queue.SimpleQueue()
+    repeat_filter = RepeatFilter()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(repeat_filter)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    stop_flushing = threading.Event()
+    threading.Thread(target=_flush_repeats_periodically, args=(repeat_filter, stop_flushing),
+                     name='log-repeat-flush', daemon=True).start()
+
+    def _final_flush():
+        stop_flushing.set()
+        repeat_filter.flush_expired(force=True)
+
+    # atexit runs in reverse order: report pending counts before the listener stops
+    atexit.register(_final_flush)
+
+    logger.handlers[:] = [queue_handler]
+    logger.propagate = False
+    set_log_level(level)
+    return listener
+
+
+def set_log_level(level):
+    """Apply a log level name (e.g. 'DEBUG'); returns False for unknown names"""
+    if not isinstance(level, str):
+        return False
+    value = logging.getLevelName(level.upper())
+    if not isinstance(value, int):
+        return False
+    logger.setLevel(value)
+    return True
+
+
+def normalize_settings(settings, current=None):
+    """Validate pushed/stored settings on top of ``current`` (defaults if None).
+
+    Returns (normalized, rejected): rejected values are logged and leave the
+    current value in place; ``rejected`` lists their keys.
+    """
+    normalized = dict(current or DEFAULT_SETTINGS)
+    rejected = []
+    if not isinstance(settings, dict):
+        return normalized, rejected
+
+    for name, value in settings.items():
+        if name in SETTING_INTERVAL_LIMITS:
+            low, high = SETTING_INTERVAL_LIMITS[name]
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and low <= value <= high:
+                normalized[name] = int(value)
+                continue
+            logger.warning(f"Ignoring invalid {name}: {value!r} (allowed {low}-{high})")
+        elif name == 'log_level':
+            if isinstance(value, str) and isinstance(logging.getLevelName(value.upper()), int):
+                normalized[name] = value.upper()
+                continue
+            logger.warning(f"Ignoring unknown log level: {value!r}")
+        elif name == 'enabled_collectors':
+            if isinstance(value, list) and all(c in COLLECTORS for c in value):
+                normalized[name] = [c for c in COLLECTORS if c in value]
+                continue
+            logger.warning(f"Ignoring invalid enabled_collectors: {value!r}")
+        else:
+            logger.warning(f"Ignoring unknown setting: {name}")
+        rejected.append(name)
+
+    return normalized, rejected
+
+
+class ConfigStore:
+    """Cached, validated view of config.json with atomic writes and change detection"""
+
+    def __init__(self, path, platform_name):
+        self.path = path
+        self.platform = platform_name
+        self.data = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _validate(self, data):
+        if not isinstance(data, dict):
+            raise ValueError("config root must be a JSON object")
+        if not data.get('install_token'):
+            for field in ('agent_id', 'api_key'):
+                if not isinstance(data.get(field), str) or not data[field]:
+                    raise ValueError(f"missing {field}")
+
+        # log_level used to be stored at the top level
+        settings = dict(data.get('settings') or {})
+        if 'log_level' in data:
+            settings.setdefault('log_level', data.pop('log_level'))
+        data['settings'] = normalize_settings(settings)[0]
+        return data
+
+    def load(self):
+        """Read, validate and cache config.json; raises on missing/invalid file"""
+        with self._lock:
+            signature = self._stat_signature()
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = self._validate(json.load(f))
+            self.data = data
+            self._signature = signature
+            return data
+
+    def save(self, data):
+        """Write config atomically: temp file in the same dir, fsync, rename"""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            fd, temp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if self.platform != "windows":
+                    os.chmod(temp_path, 0o600)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+
+            if self.platform != "windows":
+                # Persist the rename itself
+                dir_fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+
+            self.data = data
+            self._signature = self._stat_signature()
+
+    def reload_if_changed(self):
+        """Reload when config.json was modified externally; returns True on reload"""
+        signature = self._stat_signature()
+        if signature is None or signature == self._signature:
+            return False
+        try:
+            self.load()
+        except Exception as e:
+            # Keep the cached view; remember the signature so we warn only once
+            self._signature = signature
+            logger.error(f"Ignoring invalid config change: {e}")
+            return False
+        return True
+
 
 class GPSSAgent:
     def __init__(self):
         self.config = None
         self.platform = platform.system().lower()
         self.config_path = self._get_config_path()
+        self.store = ConfigStore(self.config_path, self.platform)
+        self._kb_cache = None
+        self._kb_cache_stamp = None
+        self._kb_cache_time = 0
+        self.reboot_pending = None
+        self._os_version = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=COLLECTOR_WORKERS, thread_name_prefix='collector')
+        self._collector_futures = {}  # name -> most recent future (may still be running)
+        self._last_collected = {}  # name -> (fields, unix time) of last successful run
 
     def _get_config_path(self):
         """Get platform-specific config path"""
@@ -68,49 +434,202 @@ class GPSSAgent:
         return None
 
     def _get_installed_kbs(self):
-        """Get installed Windows KB updates"""
-        kbs = []
+        """Get installed Windows KB updates, re-querying only after servicing changes"""
+        self.reboot_pending = self._is_reboot_pending()
+        stamp = self._get_servicing_stamp()
+
+        if self._kb_cache is not None:
+            if stamp is not None and stamp == self._kb_cache_stamp:
+                return self._kb_cache
+            if stamp is None and time.time() - self._kb_cache_time < KB_CACHE_TTL:
+                return self._kb_cache
+
+        kbs = {}
+        sources = 0
+
+        # wmic is deprecated (and absent on recent Windows 11 builds); without
+        # it the CBS registry data alone still gives KB ids, states and dates
         try:
-            result = subprocess.run(['wmic', 'qfe', 'get', 'HotFixID,InstalledOn'],
-                                  capture_output=True, text=True, timeout=30)
-            lines = result.stdout.strip().split('\n')
-            for line in lines[1:]:  # Skip header
-                if line.strip() and 'KB' in line:
-                    parts = line.strip().split()
-                    if parts:
-                        kb_id = parts[0]
-                        install_date = ' '.join(parts[1:]) if len(parts) > 1 else 'Unknown'
-                        kbs.append({'kb_id': kb_id, 'installed_on': install_date})
+            for kb_id, installed_on in self._query_hotfixes():
+                kbs[kb_id] = {'kb_id': kb_id, 'installed_on': installed_on, 'state': 'installed'}
+            sources += 1
         except Exception as e:
-            print(f"Error getting KBs: {e}")
-        return kbs
+            logger.warning(f"Error getting KBs from wmic, using CBS data only: {e}")
 
-    def _get_installed_software(self):
-        """Get installed software with versions"""
+        try:
+            # CBS install times are locale independent, so they win over InstalledOn
+            for kb_id, (state, installed_on) in self._get_cbs_kb_states().items():
+                kb = kbs.setdefault(kb_id, {'kb_id': kb_id, 'installed_on': None})
+                kb['state'] = state
+                if installed_on:
+                    kb['installed_on'] = installed_on
+            sources += 1
+        except Exception as e:
+            logger.warning(f"Error getting KB states from CBS: {e}")
+
+        if not sources:
+            return self._kb_cache or []
+
+        self._kb_cache = sorted(kbs.values(), key=lambda kb: kb['kb_id'])
+        self._kb_cache_stamp = stamp
+        self._kb_cache_time = time.time()
+        logger.debug(f"KB list refreshed ({len(self._kb_cache)} entries)")
+        return self._kb_cache
+
+    def _query_hotfixes(self):
+        """Yield (kb_id, iso_install_date) pairs from Win32_QuickFixEngineering"""
+        result = subprocess.run(['wmic', 'qfe', 'get', 'HotFixID,InstalledOn', '/format:csv'],
+                              capture_output=True, text=True, timeout=30)
+        for line in result.stdout.splitlines():
+            # CSV columns: Node,HotFixID,InstalledOn
+            parts = [p.strip() for p in line.split(',')]
+            if len(parts) < 3 or not KB_PATTERN.fullmatch(parts[1]):
+                continue
+            yield parts[1].upper(), self._parse_install_date(parts[2])
+
+    def _filetime_to_iso(self, filetime):
+        """Convert a Windows FILETIME (100 ns ticks since 1601) to an ISO date"""
+        if not filetime:
+            return None
+        try:
+            return (datetime(1601, 1, 1) + timedelta(microseconds=filetime // 10)).date().isoformat()
+        except OverflowError:
+            return None
+
+    def _parse_install_date(self, value):
+        """Normalize a locale dependent InstalledOn value to an ISO date.
+
+        Returns None when the value cannot be parsed, or when it is a
+        slash-separated date whose day and month cannot be told apart.
+        """
+        value = (value or '').strip()
+        if not value:
+            return None
+
+        # Some systems store a hex FILETIME instead of a date
+        if re.fullmatch(r'[0-9a-fA-F]{15,16}', value):
+            return self._filetime_to_iso(int(value, 16))
+
+        # M/D/YYYY or D/M/YYYY depending on locale: only accept unambiguous values
+        match = re.fullmatch(r'(\d{1,2})/(\d{1,2})/(\d{4})', value)
+        if match:
+            first, second, year = (int(part) for part in match.groups())
+            if first > 12 or first == second:
+                day, month = first, second
+            elif second > 12:
+                day, month = second, first
+            else:
+                return None
+            try:
+                return datetime(year, month, day).date().isoformat()
+            except ValueError:
+                return None
+
+        for fmt in ('%d.%m.%Y', '%Y-%m-%d', '%Y%m%d', '%Y/%m/%d'):
+            try:
+                return datetime.strptime(value, fmt).date().isoformat()
+            except ValueError:
+                continue
+        return None
+
+    def _get_servicing_stamp(self):
+        """Return a value that changes whenever CBS packages are added, removed or staged"""
+        if winreg is None:
+            return None
+        try:
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, CBS_KEY + r"\Packages") as key:
+                last_write = winreg.QueryInfoKey(key)[2]
+            return (last_write, self.reboot_pending)
+        except OSError:
+            return None
+
+    def _is_reboot_pending(self):
+        """Check whether Windows is waiting for a reboot to finish servicing"""
+        if winreg is None:
+            return None
+        for path in REBOOT_PENDING_KEYS:
+            try:
+                winreg.CloseKey(winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, path))
+                return True
+            except OSError:
+                continue
+        return False
+
+    def _get_cbs_kb_states(self):
+        """Map KB ids to (servicing state, ISO install date or None).
+
+        The state is installed/superseded/pending_reboot/staged; the date
+        comes from the package's InstallTimeHigh/InstallTimeLow FILETIME.
+        """
+        states = {}
+        if winreg is None:
+            return states
+
+        # An unreadable Packages key raises so callers know CBS data is missing
+        with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, CBS_KEY + r"\Packages") as packages:
+            index = 0
+            while True:
+                try:
+                    name = winreg.EnumKey(packages, index)
+                except OSError:
+                    break
+                index += 1
+
+                match = KB_PATTERN.search(name)
+                if not match:
+                    continue
+                try:
+                    with winreg.OpenKey(packages, name) as package:
+                        current_state = winreg.QueryValueEx(package, 'CurrentState')[0]
+                        try:
+                            high = winreg.QueryValueEx(package, 'InstallTimeHigh')[0]
+                            low = winreg.QueryValueEx(package, 'InstallTimeLow')[0]
+                            installed_on = self._filetime_to_iso((high << 32) | (low & 0xFFFFFFFF))
+                        except OSError:
+                            installed_on = None
+                except OSError:
+                    continue
+
+                state = CBS_PACKAGE_STATES.get(current_state)
+                if not state:
+                    continue
+                kb_id = match.group(0).upper()
+                previous = states.get(kb_id)
+                if previous is None or state[1] > previous[1]:
+                    states[kb_id] = (state[0], state[1], installed_on)
+                elif state[1] == previous[1] and not previous[2] and installed_on:
+                    states[kb_id] = (previous[0], previous[1], installed_on)
+
+        return {kb_id: (state, installed_on) for kb_id, (state, _, installed_on) in states.items()}
+
+    def _get_installed_software(self, limit=500):
+        """Get installed software with versions (limit=None returns everything)"""
         software = []
+        # 64-bit apps, plus 32-bit apps on 64-bit Windows
+        keys = ['HKLM\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Uninstall']
+        if platform.machine().endswith('64'):
+            keys.append('HKLM\\SOFTWARE\\WOW6432Node\\Microsoft\\Windows\\CurrentVersion\\Uninstall')
+
+        processes = []
         try:
-            # Get from registry - 64-bit apps
-            result = subprocess.run([
-                'reg', 'query',
-                'HKLM\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Uninstall',
-                '/s'
-            ], capture_output=True, text=True, timeout=60)
-
-            software.extend(self._parse_registry_software(result.stdout))
-
-            # Get from registry - 32-bit apps on 64-bit Windows
-            if platform.machine().endswith('64'):
-                result = subprocess.run([
-                    'reg', 'query',
-                    'HKLM\\SOFTWARE\\WOW6432Node\\Microsoft\\Windows\\CurrentVersion\\Uninstall',
-                    '/s'
-                ], capture_output=True, text=True, timeout=60)
-                software.extend(self._parse_registry_software(result.stdout))
+            # Start both registry scans before reading either so they overlap
+            for key in keys:
+                processes.append(subprocess.Popen(['reg', 'query', key, '/s'],
+                                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True))
+            deadline = time.monotonic() + 60
+            for process in processes:
+                stdout, _ = process.communicate(timeout=max(1, deadline - time.monotonic()))
+                software.extend(self._parse_registry_software(stdout))
 
         except Exception as e:
-            print(f"Error getting software: {e}")
+            logger.warning(f"Error getting software: {e}")
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.communicate()
 
-        return software[:500]  # Limit to 500 entries
+        return software[:limit] if limit else software
 
     def _parse_registry_software(self, reg_output):
         """Parse registry output for software"""
@@ -220,37 +739,132 @@ class GPSSAgent:
 
     def _get_system_info(self):
         """Collect complete system information"""
+        if self._os_version is None:
+            # Changes only with a reboot, which restarts the agent anyway
+            self._os_version = self._get_windows_version() if self.platform == 'windows' else platform.platform()
+
         info = {
             'hostname': socket.gethostname(),
             'platform': self.platform,
-            'os_version': self._get_windows_version() if self.platform == 'windows' else platform.platform(),
-            'internal_ip': self._get_internal_ip(),
+            'os_version': self._os_version,
             'timestamp': datetime.now().isoformat()
         }
 
-        # Get CPU info
-        info['cpu_usage'] = self._get_cpu_usage()
-
-        # Get RAM info
-        ram_info = self._get_ram_info()
-        info['ram_total_gb'] = ram_info['total_gb']
-        info['ram_used_gb'] = ram_info['used_gb']
-        info['ram_usage_percent'] = ram_info['usage_percent']
-
-        # Get Disk info
-        disk_info = self._get_disk_info()
-        info['disk_total_gb'] = disk_info['total_gb']
-        info['disk_used_gb'] = disk_info['used_gb']
-        info['disk_usage_percent'] = disk_info['usage_percent']
-
-        # Windows-specific data
-        if self.platform == 'windows':
-            info['windows_serial'] = self._get_windows_serial()
-            info['installed_kbs'] = self._get_installed_kbs()
-            info['installed_software'] = self._get_installed_software()
+        # Disabled collectors are omitted so the server keeps its last
+        # known values instead of clearing them
+        fields, stale, _ = self._run_collectors(self._available_collectors(self.settings['enabled_collectors']))
+        info.update(fields)
+        if stale:
+            info['stale_collectors'] = stale
 
         return info
 
+    def _run_collectors(self, names, progress=None):
+        """Run collectors concurrently, each bounded by its own deadline and the global budget.
+
+        Returns (fields, stale, errors). Collectors that miss their deadline
+        keep running in the background; their last successful values are
+        used instead and they are listed in ``stale`` as name -> ISO time of
+        that data (None if there is none yet).
+        """
+        start = time.monotonic()
+        budget_end = start + COLLECTION_BUDGET
+        pending = {}
+        deadlines = {}
+        for name in names:
+            future = self._collector_futures.get(name)
+            # Never start a second copy of a collector that is still running
+            if future is None or future.done():
+                future = self._executor.submit(self._collect, name)
+                future.add_done_callback(lambda f, name=name: self._remember_collection(name, f))
+                self._collector_futures[name] = future
+            pending[future] = name
+            deadlines[name] = min(start + COLLECTOR_TIMEOUTS.get(name, 30), budget_end)
+
+        results = {}
+        errors = {}
+        while pending:
+            next_deadline = min(deadlines[name] for name in pending.values())
+            concurrent.futures.wait(
+                pending, timeout=max(0, next_deadline - time.monotonic()),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+
+            # Harvest everything that has finished by now (including futures
+            # that completed after wait() returned) before timing anything out
+            now = time.monotonic()
+            finished = []
+            for future, name in list(pending.items()):
+                if future.done():
+                    del pending[future]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        errors[name] = str(e)
+                    finished.append(name)
+                elif now >= deadlines[name]:
+                    del pending[future]
+                    errors[name] = 'timeout'
+
+            # progress must not block: callers hand it off to another thread
+            if progress:
+                for name in finished:
+                    progress(len(results) + len(errors), len(names), name)
+
+        fields = {}
+        stale = {}
+        for name in names:
+            if name in results:
+                fields.update(results[name])
+                continue
+            last = self._last_collected.get(name)
+            if last:
+                fields.update(last[0])
+            stale[name] = datetime.fromtimestamp(last[1]).isoformat() if last else None
+
+        if errors:
+            logger.warning(f"Collectors without fresh data: {', '.join(f'{n} ({e})' for n, e in sorted(errors.items()))}")
+        logger.debug(f"Collection finished in {time.monotonic() - start:.1f}s")
+        return fields, stale, errors
+
+    def _remember_collection(self, name, future):
+        """Keep the last successful collector output for stale fallbacks"""
+        if not future.cancelled() and future.exception() is None:
+            self._last_collected[name] = (future.result(), time.time())
+
+    def _available_collectors(self, names):
+        """Filter collector names to the ones that apply to this platform"""
+        return [n for n in COLLECTORS
+                if n in names and (self.platform == 'windows' or n not in WINDOWS_COLLECTORS)]
+
+    def _collect(self, name):
+        """Run a single collector and return the fields it contributes"""
+        if name == 'internal_ip':
+            return {'internal_ip': self._get_internal_ip()}
+        if name == 'cpu':
+            return {'cpu_usage': self._get_cpu_usage()}
+        if name == 'ram':
+            ram_info = self._get_ram_info()
+            return {
+                'ram_total_gb': ram_info['total_gb'],
+                'ram_used_gb': ram_info['used_gb'],
+                'ram_usage_percent': ram_info['usage_percent']
+            }
+        if name == 'disk':
+            disk_info = self._get_disk_info()
+            return {
+                'disk_total_gb': disk_info['total_gb'],
+                'disk_used_gb': disk_info['used_gb'],
+                'disk_usage_percent': disk_info['usage_percent']
+            }
+        if name == 'windows_serial':
+            return {'windows_serial': self._get_windows_serial()}
+        if name == 'installed_kbs':
+            kbs = self._get_installed_kbs()
+            return {'installed_kbs': kbs, 'reboot_pending': self.reboot_pending}
+        if name == 'installed_software':
+            return {'installed_software': self._get_installed_software()}
+        raise ValueError(f"Unknown collector: {name}")
+
     def _send_heartbeat(self):
         """Send heartbeat with complete system info to server"""
         try:
@@ -266,22 +880,21 @@ class GPSSAgent:
                 'timestamp': int(time.time()),
                 'hostname': system_info.get('hostname'),
                 'os_version': system_info.get('os_version'),
-                'internal_ip': system_info.get('internal_ip'),
-                'cpu_usage': system_info.get('cpu_usage'),
-                'ram_total_gb': system_info.get('ram_total_gb'),
-                'ram_used_gb': system_info.get('ram_used_gb'),
-                'ram_usage_percent': system_info.get('ram_usage_percent'),
-                'disk_total_gb': system_info.get('disk_total_gb'),
-                'disk_used_gb': system_info.get('disk_used_gb'),
-                'disk_usage_percent': system_info.get('disk_usage_percent'),
                 'platform': system_info.get('platform')
             }
 
-            # Add Windows-specific data
-            if self.platform == 'windows':
-                heartbeat_data['windows_serial'] = system_info.get('windows_serial')
-                heartbeat_data['installed_kbs'] = system_info.get('installed_kbs', [])
-                heartbeat_data['installed_software'] = system_info.get('installed_software', [])
+            # Collector fields (Windows-specific ones only exist on Windows).
+            # Fields from disabled collectors, or ones that never returned
+            # data, are left out so the server keeps its last known values.
+            for key in ('internal_ip', 'cpu_usage',
+                        'ram_total_gb', 'ram_used_gb', 'ram_usage_percent',
+                        'disk_total_gb', 'disk_used_gb', 'disk_usage_percent',
+                        'windows_serial', 'installed_kbs', 'reboot_pending', 'installed_software'):
+                if key in system_info:
+                    heartbeat_data[key] = system_info[key]
+
+            if system_info.get('stale_collectors'):
+                heartbeat_data['stale_collectors'] = system_info['stale_collectors']
 
             data = json.dumps(heartbeat_data).encode('utf-8')
 
@@ -302,12 +915,50 @@ class GPSSAgent:
             with urllib.request.urlopen(req, context=context, timeout=60) as response:
                 result = json.loads(response.read().decode('utf-8'))
 
+            if result.get('success') and isinstance(result.get('data'), dict):
+                self._apply_server_settings(result['data'])
+
             return result.get('success', False)
 
         except Exception as e:
-            print(f"Heartbeat error: {e}")
+            logger.error(f"Heartbeat error: {e}")
             return False
 
+    @property
+    def settings(self):
+        """Effective runtime settings (intervals, collectors, log level)"""
+        if self.config and self.config.get('settings'):
+            return self.config['settings']
+        return DEFAULT_SETTINGS
+
+    def _apply_server_settings(self, data):
+        """Apply settings pushed by the server; returns (applied, rejected) keys"""
+        pushed = data.get('settings')
+        if not isinstance(pushed, dict):
+            # Older servers send settings directly in the response's data object
+            pushed = {k: data[k] for k in DEFAULT_SETTINGS if k in data}
+        if not pushed:
+            return [], []
+
+        settings, rejected = normalize_settings(pushed, current=self.settings)
+        applied = [key for key in pushed if key not in rejected]
+        if settings != self.settings:
+            self.config['settings'] = settings
+            self._apply_settings()
+            self._save_config()
+        return applied, rejected
+
+    def _apply_settings(self):
+        """Make the current settings take effect without restarting"""
+        settings = self.settings
+        set_log_level(settings['log_level'])
+        logger.info(
+            f"Settings applied: heartbeat every {settings['heartbeat_interval']}s, "
+            f"commands every {settings['command_check_interval']}s, "
+            f"log level {settings['log_level']}, "
+            f"collectors {', '.join(settings['enabled_collectors']) or 'none'}"
+        )
+
     def _check_pending_commands(self):
         """Check for pending commands from server"""
         try:
@@ -335,7 +986,7 @@ class GPSSAgent:
             return []
 
         except Exception as e:
-            print(f"Command check error: {e}")
+            logger.error(f"Command check error: {e}")
             return []
 
     def _execute_command(self, command):
@@ -344,13 +995,25 @@ class GPSSAgent:
         command_type = command.get('command_type')
         params = command.get('parameters', {})
 
-        print(f"\n[{time.strftime('%H:%M:%S')}] Executing command: {command_type}")
+        logger.info(f"Executing command: {command_type} (ID: {command_id})")
 
         try:
             if command_type == 'uninstall_software':
                 result = self._uninstall_software(params.get('software_name'), params.get('uninstall_string'))
             elif command_type == 'update_agent':
                 result = self._update_agent(params.get('download_url'))
+            elif command_type == 'collect':
+                result = self._collect_on_demand(command_id, params.get('collectors'), params.get('refresh', True))
+            elif command_type == 'query_package':
+                result = self._query_package(params.get('name'), params.get('version'))
+            elif command_type == 'file_hash':
+                result = self._file_hash(command_id, params.get('path'), params.get('algorithm', 'sha256'))
+            elif command_type == 'apply_settings':
+                applied, rejected = self._apply_server_settings({'settings': params})
+                result = {'success': bool(applied), 'applied': applied, 'rejected': rejected,
+                          'settings': self.settings}
+                if not applied:
+                    result['error'] = 'No valid settings to apply'
             elif command_type == 'restart_agent':
                 result = self._restart_agent()
             elif command_type == 'uninstall_agent':
@@ -364,17 +1027,124 @@ class GPSSAgent:
             return result
 
         except Exception as e:
+            logger.exception(f"Command {command_type} raised an error")
             error_result = {'success': False, 'error': str(e)}
             self._report_command_result(command_id, error_result)
             return error_result
 
+    def _collect_on_demand(self, command_id, collectors=None, refresh=True):
+        """Run selected collectors immediately (all of them by default)"""
+        if collectors is None:
+            collectors = COLLECTORS
+        if not isinstance(collectors, list) or not all(isinstance(c, str) for c in collectors):
+            return {'success': False, 'error': 'collectors must be a list of collector names'}
+        requested = collectors or COLLECTORS
+        unknown = [c for c in requested if c not in COLLECTORS]
+        if unknown:
+            return {'success': False, 'error': f"Unknown collectors: {', '.join(unknown)}"}
+        if not isinstance(refresh, bool):
+            return {'success': False, 'error': 'refresh must be true or false'}
+
+        names = self._available_collectors(requested)
+        if refresh and 'installed_kbs' in names:
+            self._kb_cache = None
+
+        data = {
+            'hostname': socket.gethostname(),
+            'platform': self.platform,
+            'timestamp': datetime.now().isoformat()
+        }
+        # Progress POSTs go through their own thread so they cannot eat
+        # into the collectors' deadlines
+        reporter = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='progress')
+        updates = [reporter.submit(self._report_command_progress, command_id, 0, len(names), 'collecting')]
+        try:
+            fields, stale, errors = self._run_collectors(
+                names,
+                progress=lambda completed, total, name: updates.append(reporter.submit(
+                    self._report_command_progress, command_id, completed, total, f"collected {name}")))
+        finally:
+            # Drop queued updates; the final result supersedes them
+            for update in updates:
+                update.cancel()
+            reporter.shutdown(wait=True)
+        data.update(fields)
+
+        # A collector counts if it returned fresh data or has an older value to fall back on
+        collected = [name for name in names if name not in stale or stale[name] is not None]
+        result = {'success': bool(collected), 'collectors': names, 'data': data}
+        if not collected:
+            result['error'] = 'No collector returned data'
+        elif len(collected) < len(names) or stale:
+            result['partial'] = True
+        if stale:
+            result['stale_collectors'] = stale
+        if errors:
+            result['collector_errors'] = errors
+        return result
+
+    def _query_package(self, name, version=None):
+        """Check whether software matching name (and optionally version) is installed"""
+        if not name:
+            return {'success': False, 'error': 'Missing package name'}
+        if self.platform != 'windows':
+            return {'success': False, 'error': 'Package query only supported on Windows'}
+
+        needle = name.lower()
+        matches = [app for app in self._get_installed_software(limit=None)
+                   if needle in app['name'].lower()]
+        if version:
+            matches = [app for app in matches if app.get('version') == version]
+
+        return {
+            'success': True,
+            'data': {'name': name, 'version': version, 'present': bool(matches), 'matches': matches}
+        }
+
+    def _file_hash(self, command_id, path, algorithm='sha256'):
+        """Hash a file in blocks, reporting progress for large files"""
+        if not path:
+            return {'success': False, 'error': 'Missing file path'}
+        algorithm = (algorithm or 'sha256').lower()
+        if algorithm not in HASH_ALGORITHMS:
+            return {'success': False, 'error': f'Unsupported algorithm: {algorithm}'}
+
+        try:
+            stat = os.stat(path)
+            if not os.path.isfile(path):
+                return {'success': False, 'error': f'Not a regular file: {path}'}
+
+            digest = hashlib.new(algorithm)
+            done = 0
+            last_progress = time.time()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+                    done += len(block)
+                    if time.time() - last_progress >= PROGRESS_INTERVAL:
+                        self._report_command_progress(command_id, done, stat.st_size, 'hashing')
+                        last_progress = time.time()
+
+            return {
+                'success': True,
+                'data': {
+                    'path': path,
+                    'algorithm': algorithm,
+                    'hash': digest.hexdigest(),
+                    'size': stat.st_size,
+                    'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                }
+            }
+        except OSError as e:
+            return {'success': False, 'error': str(e)}
+
     def _uninstall_software(self, software_name, uninstall_string):
         """Uninstall software on Windows"""
         try:
             if not software_name or not uninstall_string:
                 return {'success': False, 'error': 'Missing software name or uninstall string'}
 
-            print(f"  Uninstalling: {software_name}")
+            logger.info(f"Uninstalling: {software_name}")
 
             # Execute uninstall command silently
             if self.platform == 'windows':
@@ -416,7 +1186,7 @@ class GPSSAgent:
             if not download_url:
                 return {'success': False, 'error': 'Missing download URL'}
 
-            print(f"  Downloading update from: {download_url}")
+            logger.info(f"Downloading update from: {download_url}")
 
             # Download new version
             temp_file = os.path.join(os.path.dirname(sys.executable), 'GPSS-Agent-Update.exe')
@@ -428,7 +1198,7 @@ class GPSSAgent:
                 with open(temp_file, 'wb') as f:
                     f.write(response.read())
 
-            print(f"  Downloaded to: {temp_file}")
+            logger.info(f"Downloaded to: {temp_file}")
 
             # Replace current executable
             current_exe = sys.executable
@@ -443,7 +1213,7 @@ class GPSSAgent:
             # Move new version
             os.rename(temp_file, current_exe)
 
-            print("  Update installed. Restarting...")
+            logger.info("Update installed. Restarting...")
 
             # Restart agent
             if self.platform == 'windows':
@@ -460,7 +1230,7 @@ class GPSSAgent:
     def _restart_agent(self):
         """Restart the agent"""
         try:
-            print("  Restarting agent...")
+            logger.info("Restarting agent...")
 
             current_exe = sys.executable
 
@@ -478,7 +1248,7 @@ class GPSSAgent:
     def _uninstall_agent(self):
         """Uninstall the agent"""
         try:
-            print("  Uninstalling agent...")
+            logger.info("Uninstalling agent...")
 
             # Remove config file
             if os.path.exists(self.config_path):
@@ -522,47 +1292,101 @@ class GPSSAgent:
                 else:
                     os.remove(current_exe)
 
-            print("  Agent uninstalled")
+            logger.info("Agent uninstalled")
             sys.exit(0)
 
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def _report_command_result(self, command_id, result):
-        """Report command execution result to server"""
-        try:
-            url = f"{SERVER_URL}/agent/commands/result"
+    def _post_command_update(self, payload, timeout=30):
+        """POST a result, chunk or progress update to the command result endpoint"""
+        url = f"{SERVER_URL}/agent/commands/result"
 
-            data = json.dumps({
+        data = json.dumps({**payload, 'timestamp': int(time.time())}).encode('utf-8')
+
+        req = urllib.request.Request(
+            url,
+            data=data,
+            headers={
+                'Content-Type': 'application/json',
+                'User-Agent': 'GPSS-Agent/2.0',
+                'X-Agent-ID': self.config['agent_id'],
+                'X-API-Key': self.config['api_key']
+            },
+            method='POST'
+        )
+
+        context = ssl.create_default_context()
+
+        with urllib.request.urlopen(req, context=context, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def _report_command_progress(self, command_id, completed, total, stage):
+        """Send a progress update for a long-running command (best effort)"""
+        try:
+            self._post_command_update({
                 'command_id': command_id,
-                'result': result,
-                'timestamp': int(time.time())
-            }).encode('utf-8')
+                'progress': {
+                    'completed': completed,
+                    'total': total,
+                    'percent': round(completed * 100 / total, 1) if total else None,
+                    'stage': stage
+                }
+            })
+        except Exception as e:
+            logger.debug(f"Error reporting progress: {e}")
 
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers={
-                    'Content-Type': 'application/json',
-                    'User-Agent': 'GPSS-Agent/2.0',
-                    'X-Agent-ID': self.config['agent_id'],
-                    'X-API-Key': self.config['api_key']
-                },
-                method='POST'
-            )
+    def _post_chunk(self, command_id, index, total, data, attempts=3):
+        """Send one result chunk, retrying transient failures"""
+        for attempt in range(1, attempts + 1):
+            try:
+                return self._post_command_update({
+                    'command_id': command_id,
+                    'chunk': {'index': index, 'total': total, 'data': data}
+                }, timeout=60)
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                logger.warning(f"Retrying result chunk {index + 1}/{total}: {e}")
+                time.sleep(2 * attempt)
 
-            context = ssl.create_default_context()
+    def _report_command_result(self, command_id, result):
+        """Report command execution result to server.
 
-            with urllib.request.urlopen(req, context=context, timeout=30) as response:
-                response_data = json.loads(response.read().decode('utf-8'))
+        Large ``data`` payloads are sent first as numbered chunks of the
+        serialized JSON; the final result then references them instead of
+        embedding the data.
+        """
+        try:
+            if 'data' in result:
+                serialized = json.dumps(result['data'])
+                if len(serialized) > RESULT_CHUNK_SIZE:
+                    total = (len(serialized) + RESULT_CHUNK_SIZE - 1) // RESULT_CHUNK_SIZE
+                    try:
+                        for index in range(total):
+                            self._post_chunk(command_id, index, total,
+                                             serialized[index * RESULT_CHUNK_SIZE:(index + 1) * RESULT_CHUNK_SIZE])
+                    except Exception as e:
+                        # Close the command out instead of leaving partial chunks behind
+                        logger.error(f"Error sending result chunk {index + 1}/{total}: {e}")
+                        result = {'success': False, 'error': f'Failed to send result chunk {index + 1}/{total}: {e}'}
+                    else:
+                        result = {key: value for key, value in result.items() if key != 'data'}
+                        result['chunked'] = {
+                            'chunks': total,
+                            'size': len(serialized),
+                            'sha256': hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+                        }
+
+            self._post_command_update({'command_id': command_id, 'result': result})
 
             if result.get('success'):
-                print(f"  ✓ Command completed successfully")
+                logger.info(f"✓ Command {command_id} completed successfully")
             else:
-                print(f"  ✗ Command failed: {result.get('error')}")
+                logger.warning(f"✗ Command {command_id} failed: {result.get('error')}")
 
         except Exception as e:
-            print(f"  Error reporting result: {e}")
+            logger.error(f"Error reporting result: {e}")
 
     def _is_first_run(self):
         """Check if this is first run"""
@@ -654,24 +1478,20 @@ class GPSSAgent:
     def _save_config(self):
         """Save configuration"""
         try:
-            with open(self.config_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
-            if self.platform != "windows":
-                os.chmod(self.config_path, 0o600)
-            print(f"✓ Config saved to {self.config_path}")
+            self.store.save(self.config)
+            logger.info(f"✓ Config saved to {self.config_path}")
             return True
         except Exception as e:
-            print(f"✗ Save failed: {e}")
+            logger.error(f"✗ Save failed: {e}")
             return False
 
     def _load_config(self):
         """Load configuration"""
         try:
-            with open(self.config_path, 'r') as f:
-                self.config = json.load(f)
+            self.config = self.store.load()
             return True
         except Exception as e:
-            print(f"Error loading config: {e}")
+            logger.error(f"Error loading config: {e}")
             return False
 
     def first_run_setup(self):
@@ -696,11 +1516,13 @@ class GPSSAgent:
 
     def run(self):
         """Main agent loop"""
-        print(f"\nGPSS Agent v2.0 (Platform: {self.platform})")
-        print(f"Agent ID: {self.config['agent_id']}")
-        print(f"Server: {self.config['server_url']}")
-        print(f"Hostname: {socket.gethostname()}")
-        print("Press Ctrl+C to stop\n")
+        set_log_level(self.settings['log_level'])
+
+        logger.info(f"GPSS Agent v2.0 (Platform: {self.platform})")
+        logger.info(f"Agent ID: {self.config['agent_id']}")
+        logger.info(f"Server: {self.config['server_url']}")
+        logger.info(f"Hostname: {socket.gethostname()}")
+        logger.info("Press Ctrl+C to stop")
 
         last_heartbeat = 0
         last_command_check = 0
@@ -709,19 +1531,25 @@ class GPSSAgent:
             while True:
                 current_time = time.time()
 
+                # Pick up external edits to config.json
+                if self.store.reload_if_changed():
+                    logger.info("Config file changed, reloading")
+                    self.config = self.store.data
+                    self._apply_settings()
+
                 # Send heartbeat
-                if current_time - last_heartbeat >= HEARTBEAT_INTERVAL:
+                if current_time - last_heartbeat >= self.settings['heartbeat_interval']:
                     if self._send_heartbeat():
-                        print(f"[{time.strftime('%H:%M:%S')}] ✓ Heartbeat sent")
+                        logger.info("✓ Heartbeat sent")
                     else:
-                        print(f"[{time.strftime('%H:%M:%S')}] ✗ Heartbeat failed")
+                        logger.warning("✗ Heartbeat failed")
                     last_heartbeat = current_time
 
                 # Check for pending commands
-                if current_time - last_command_check >= COMMAND_CHECK_INTERVAL:
+                if current_time - last_command_check >= self.settings['command_check_interval']:
                     commands = self._check_pending_commands()
                     if commands:
-                        print(f"[{time.strftime('%H:%M:%S')}] Found {len(commands)} pending command(s)")
+                        logger.info(f"Found {len(commands)} pending command(s)")
                         for command in commands:
                             self._execute_command(command)
                     last_command_check = current_time
@@ -730,13 +1558,14 @@ class GPSSAgent:
                 time.sleep(5)
 
         except KeyboardInterrupt:
-            print("\n\nAgent stopped")
+            logger.info("Agent stopped")
         except Exception as e:
-            print(f"\n\nAgent error: {e}")
+            logger.exception(f"Agent error: {e}")
 
 def main():
     """Main entry point"""
     agent = GPSSAgent()
+    setup_logging(os.path.dirname(agent.config_path))
 
     if agent._is_first_run():
         if not agent.first_run_setup():
@@ -748,7 +1577,7 @@ def main():
             sys.exit(0)
     else:
         if not agent._load_config():
-            print("Failed to load config. Delete config and run setup again.")
+            logger.critical("Failed to load config. Delete config and run setup again.")
             sys.exit(1)
 
     agent.run()
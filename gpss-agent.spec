@@ -20,6 +20,8 @@ a = Analysis(
         'platform',
         'subprocess',
         'hashlib',
+        'logging.handlers',
+        'queue',
     ],
     hookspath=[],
     hooksconfig={},